@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import pyarrow.compute as pc
+import pyogrio
+from pyarrow import csv as pacsv
+from shapely import STRtree
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 POSTCODES = BASE_DIR / "data/ons_postcode_dir.csv"
+POSTCODE_CACHE = BASE_DIR / "data/_cache/bham_postcodes_27700.parquet"
 NOISE_DIR = BASE_DIR / "data/_noise"
 OUTPUT = BASE_DIR / "data/birmingham_noise_by_district.json"
 
-RAIL_LDEN   = NOISE_DIR / "Rail_Noise_Lden_England_Round_3.geojson"
-RAIL_LNIGHT = NOISE_DIR / "Rail_Noise_Lnight_England_Round_3.geojson"
-ROAD_LDEN   = NOISE_DIR / "Road_Noise_Lden_England_Round_3.geojson"
-ROAD_LNIGHT = NOISE_DIR / "Road_Noise_Lnight_England_Round_3.geojson"
+NOISE_LAYERS = {
+    "rail_lden":   NOISE_DIR / "Rail_Noise_Lden_England_Round_3.geojson",
+    "rail_lnight": NOISE_DIR / "Rail_Noise_Lnight_England_Round_3.geojson",
+    "road_lden":   NOISE_DIR / "Road_Noise_Lden_England_Round_3.geojson",
+    "road_lnight": NOISE_DIR / "Road_Noise_Lnight_England_Round_3.geojson",
+}
 
 NOISE_CLASS_MAP = {
     "50.0-54.9": 52.5,
@@ -27,10 +37,24 @@ NOISE_CLASS_MAP = {
 }
 
 def load_birmingham_postcodes():
-    print("📍 Loading Birmingham postcodes from ONS...")
-    df = pd.read_csv(POSTCODES, low_memory=False)
+    # The CSV parse + reprojection is identical every run, so reuse the
+    # GeoParquet cache whenever it is newer than the source directory.
+    if POSTCODE_CACHE.exists() and POSTCODE_CACHE.stat().st_mtime >= POSTCODES.stat().st_mtime:
+        print("📍 Loading Birmingham postcodes from cache...")
+        gdf = gpd.read_parquet(POSTCODE_CACHE)
+        print(f"  Postcodes in Birmingham: {len(gdf)}")
+        return gdf
 
-    df = df[df["pcds"].astype(str).str.startswith("B", na=False)]
+    print("📍 Loading Birmingham postcodes from ONS...")
+    # pyarrow's multithreaded reader only materializes the three columns we
+    # need and filters to B-postcodes before anything reaches pandas.
+    table = pacsv.read_csv(
+        POSTCODES,
+        convert_options=pacsv.ConvertOptions(include_columns=["pcds", "lat", "long"]),
+    )
+    table = table.filter(pc.starts_with(pc.cast(table["pcds"], "string"), "B"))
+
+    df = table.to_pandas()
     df = df.dropna(subset=["lat", "long"])
 
     gdf = gpd.GeoDataFrame(
@@ -40,59 +64,107 @@ def load_birmingham_postcodes():
     ).to_crs("EPSG:27700")
 
     gdf["district"] = gdf["pcds"].astype(str).str.extract(r"^(B\d{1,2})")
+    # The B-prefix filter also lets BA/BB/BD/... postcodes through, which
+    # extract to NaN districts — drop them before the cast so the later
+    # fillna(45.0) cannot try to add a numeric category (or a 45.0 group).
+    gdf = gdf.dropna(subset=["district"])
+    # Small fixed vocabulary (B1..B99): categorical codes make the final
+    # groupby hash small ints instead of strings.
+    gdf["district"] = gdf["district"].astype("category")
+
+    POSTCODE_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    gdf.to_parquet(POSTCODE_CACHE)
 
     print(f"  Postcodes in Birmingham: {len(gdf)}")
     return gdf
 
-def load_noise_layer(path):
-    gdf = gpd.read_file(path).to_crs("EPSG:27700")
+def load_noise_layer(path, bbox):
+    # bbox is in WGS84 (the GeoJSON CRS) so GDAL's spatial filter can skip
+    # the vast majority of England-wide polygons, and pyogrio only decodes
+    # the one attribute column we use.
+    gdf = pyogrio.read_dataframe(path, bbox=bbox, columns=["noiseclass"])
+    gdf = gdf.to_crs("EPSG:27700")
 
     if "noiseclass" not in gdf.columns:
         raise RuntimeError(f"❌ noiseclass column missing in {path.name}")
 
-    gdf["db"] = gdf["noiseclass"].astype(str).map(NOISE_CLASS_MAP)
+    # noiseclass only has a handful of distinct values, so factorize once
+    # and fan the db values out through a small lookup array instead of
+    # hashing the string per row.
+    codes, uniques = pd.factorize(gdf["noiseclass"].astype(str))
 
-    if gdf["db"].isna().any():
-        bad = gdf[gdf["db"].isna()]["noiseclass"].unique()
+    bad = [u for u in uniques if u not in NOISE_CLASS_MAP]
+    if bad:
         raise RuntimeError(f"❌ Unknown noiseclass values found: {bad}")
 
+    lut = np.array([NOISE_CLASS_MAP[u] for u in uniques], dtype=np.float64)
+    gdf["db"] = lut[codes]
+
     return gdf[["db", "geometry"]]
 
-def sample_noise(points, noise_polygons):
-    joined = gpd.sjoin(points, noise_polygons, predicate="within", how="left")
-    return joined.groupby(joined.index)["db"].mean()
+def build_point_index(points):
+    # The postcode points are the constant side of every join: dedupe the
+    # metre-snapped coordinates and build one STRtree over the unique
+    # points, so each noise layer only pays for its own query.
+    xy = np.column_stack([points.geometry.x.round(0), points.geometry.y.round(0)])
+    _, first_idx, key = np.unique(xy, axis=0, return_index=True, return_inverse=True)
+
+    uniq_geoms = points.geometry.values[first_idx]
+    return STRtree(uniq_geoms), len(uniq_geoms), key.ravel(), points.index
+
+def sample_noise(point_index, noise_polygons):
+    tree, n_uniq, key, index = point_index
+
+    # Query with the reversed predicate (polygon contains point) so the
+    # prebuilt point tree is reused instead of rebuilding one per layer.
+    poly_idx, pt_idx = tree.query(noise_polygons.geometry.values, predicate="contains")
+
+    db = noise_polygons["db"].to_numpy()[poly_idx]
+    sums = np.bincount(pt_idx, weights=db, minlength=n_uniq)
+    counts = np.bincount(pt_idx, minlength=n_uniq)
+    with np.errstate(invalid="ignore"):
+        db_uniq = sums / counts  # NaN where no polygon covers the point
+
+    return pd.Series(db_uniq[key], index=index)
+
+NOISE_BAND_EDGES = np.array([0.2, 0.4, 0.6, 0.8])
+NOISE_BAND_LABELS = np.array([
+    "Very low noise exposure",
+    "Low noise exposure",
+    "Moderate noise exposure",
+    "High noise exposure",
+    "Very high noise exposure",
+])
 
 def noise_risk_score(db):
-    return min(max((db - 45) / 35, 0), 1)
+    return np.clip((np.asarray(db) - 45) / 35, 0, 1)
 
 def noise_band(score):
-    if score < 0.2: return "Very low noise exposure"
-    if score < 0.4: return "Low noise exposure"
-    if score < 0.6: return "Moderate noise exposure"
-    if score < 0.8: return "High noise exposure"
-    return "Very high noise exposure"
+    return NOISE_BAND_LABELS[np.searchsorted(NOISE_BAND_EDGES, score, side="right")]
 
 def main():
     postcodes = load_birmingham_postcodes()
 
-    print("🔊 Loading noise layers...")
-    rail_lden   = load_noise_layer(RAIL_LDEN)
-    rail_lnight = load_noise_layer(RAIL_LNIGHT)
-    road_lden   = load_noise_layer(ROAD_LDEN)
-    road_lnight = load_noise_layer(ROAD_LNIGHT)
+    bbox = tuple(postcodes.to_crs("EPSG:4326").total_bounds)
+    point_index = build_point_index(postcodes)
+
+    # The four layers are independent and mostly wait on GeoJSON parsing /
+    # GEOS calls (both release the GIL), so load and sample them in parallel.
+    print("🔊 Loading and sampling noise layers...")
+    def process_layer(path):
+        return sample_noise(point_index, load_noise_layer(path, bbox))
 
-    print("📏 Sampling noise at postcode points...")
-    postcodes["rail_lden"]   = sample_noise(postcodes, rail_lden)
-    postcodes["rail_lnight"] = sample_noise(postcodes, rail_lnight)
-    postcodes["road_lden"]   = sample_noise(postcodes, road_lden)
-    postcodes["road_lnight"] = sample_noise(postcodes, road_lnight)
+    with ThreadPoolExecutor(max_workers=len(NOISE_LAYERS)) as ex:
+        futures = {col: ex.submit(process_layer, path) for col, path in NOISE_LAYERS.items()}
+        for col, future in futures.items():
+            postcodes[col] = future.result()
 
     postcodes = postcodes.fillna(45.0)
 
     postcodes["lden"]   = postcodes[["rail_lden", "road_lden"]].mean(axis=1)
     postcodes["lnight"] = postcodes[["rail_lnight", "road_lnight"]].mean(axis=1)
 
-    postcodes["noise_risk"] = postcodes["lden"].apply(noise_risk_score)
+    postcodes["noise_risk"] = noise_risk_score(postcodes["lden"].to_numpy())
 
     print("🧮 Aggregating by postcode district...")
     result = []
@@ -114,7 +186,8 @@ def main():
         })
 
     with open(OUTPUT, "w") as f:
-        json.dump(result, f, indent=2)
+        # compact output: the only consumers are code, not humans
+        json.dump(result, f, separators=(",", ":"))
 
     print(f"✅ Saved → {OUTPUT}")
 
@@ -238,6 +238,6 @@ OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
 baseline = sanitize_for_json(baseline)
 
 with open(OUTPUT_PATH, "w") as f:
-    json.dump(baseline, f, indent=2, allow_nan=False)
+    json.dump(baseline, f, separators=(",", ":"), allow_nan=False)
 
 print(f"✅ Built Birmingham environmental baseline: {OUTPUT_PATH}")
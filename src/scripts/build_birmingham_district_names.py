@@ -49,18 +49,15 @@ bham = bham.merge(
 )
 
 # -------- BUILD DISTRICT → NAME MAP --------
-district_map = {}
-
-for _, row in bham.iterrows():
-    d = row["district"]
-
-    # Prefer ward name, fallback to LAD name
-    name = row["WD25NM"]
-    if pd.isna(name):
-        name = row["LAD25NM"]
-
-    if pd.notna(name) and d not in district_map:
-        district_map[d] = name
+# Prefer ward name, fallback to LAD name; first named row wins per district
+bham["name"] = bham["WD25NM"].fillna(bham["LAD25NM"])
+
+district_map = (
+    bham.dropna(subset=["name"])
+    .groupby("district")["name"]
+    .first()
+    .to_dict()
+)
 
 # -------- SORT NATURALLY (B1 → B99) --------
 def sort_key(x):
@@ -70,7 +67,7 @@ district_map = dict(sorted(district_map.items(), key=lambda x: sort_key(x[0])))
 
 # -------- WRITE OUTPUT --------
 with open("data/postcode_district_names.json", "w") as f:
-    json.dump(district_map, f, indent=2)
+    json.dump(district_map, f, separators=(",", ":"))
 
 print("✅ Generated data/postcode_district_names.json")
 print("Sample:")
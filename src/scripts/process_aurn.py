@@ -10,21 +10,33 @@ OUT_P95 = Path("../data/_air/station_percentiles.json")
 KEEP_STATUS = {"V", "P", "N"}
 
 
-def find_header_row(file_path):
-    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-        for i, line in enumerate(f):
-            if line.strip().startswith("Date,Time"):
-                return i
+def find_header_offset(file_path):
+    # Return the byte offset of the real header line so the reader can
+    # seek straight past the preamble instead of re-parsing it.
+    offset = 0
+    with open(file_path, "rb") as f:
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip().startswith(b"Date,Time"):
+                return offset
+            offset += len(line)
     raise RuntimeError("Could not find header row with Date and Time")
 
 
 def main():
     print("🔍 Locating real CSV header...")
-    header_row = find_header_row(INPUT_FILE)
-    print(f"✅ Found header at line {header_row}")
+    offset = find_header_offset(INPUT_FILE)
+    print(f"✅ Found header at byte {offset}")
 
+    # The export pads missing stations by dropping trailing columns, which
+    # pyarrow's strict CSV reader rejects, so parse with pandas from a
+    # handle seeked past the preamble — one scan of the file, not two.
     print("📥 Loading AURN data...")
-    df = pd.read_csv(INPUT_FILE, skiprows=header_row)
+    with open(INPUT_FILE, "rb") as f:
+        f.seek(offset)
+        df = pd.read_csv(f)
     print("✅ Raw shape:", df.shape)
 
     df.rename(columns={"Date": "date", "Time": "time"}, inplace=True)
@@ -44,41 +56,32 @@ def main():
     df = df.drop(columns=["date", "time"])
 
     # ✅ WIDE → LONG
-    station_blocks = []
-    cols = list(df.columns)
-    print("🧱 Total columns:", len(cols))
-
-    i = 1
-    while i < len(cols) - 1:
-        value_col = cols[i]
-        status_col = cols[i + 1]
-
-        temp = df[["datetime", value_col, status_col]].copy()
-        temp.columns = ["datetime", "value", "status"]
-        temp["station"] = value_col
-
-        station_blocks.append(temp)
-        i += 2
+    # Columns alternate (value, status) per station; label the pairs with a
+    # MultiIndex and stack once instead of copy/concat-ing per station.
+    data = df.drop(columns=["datetime"])
+    print("🧱 Total columns:", data.shape[1])
+
+    n_stations = data.shape[1] // 2
+    data = data.iloc[:, : n_stations * 2]
+
+    stations = data.columns[0::2]
+    data.columns = pd.MultiIndex.from_arrays(
+        [stations.repeat(2), ["value", "status"] * n_stations],
+        names=["station", None],
+    )
+    data.index = df["datetime"]
 
-    tidy = pd.concat(station_blocks, ignore_index=True)
+    tidy = data.stack(level=0).reset_index()
     print("🧪 After melt:", tidy.shape)
 
-    # ✅ CLEAN VALUES
-    tidy["value"] = (
-        tidy["value"]
-        .astype(str)
-        .str.replace("No data", "", regex=False)
-        .str.extract(r"(\d+\.?\d*)")
-    )
+    # ✅ CLEAN VALUES — the column is numeric text or "No data", so a single
+    # to_numeric pass replaces the replace + regex-extract combination
+    tidy["value"] = pd.to_numeric(tidy["value"].astype(str).str.strip(), errors="coerce")
 
-    tidy["value"] = pd.to_numeric(tidy["value"], errors="coerce")
-
-    # ✅ CLEAN STATUS PROPERLY (THIS WAS KILLING YOUR DATA)
-    tidy["status"] = (
-        tidy["status"]
-        .astype(str)
-        .str.extract(r"([VPN])", expand=False)
-    )
+    # ✅ CLEAN STATUS — single-letter codes, so take the first character
+    # instead of running a compiled regex over every row
+    status = tidy["status"].astype(str).str.strip().str[0]
+    tidy["status"] = status.where(status.isin(list(KEEP_STATUS)))
 
     print("✅ Status counts:")
     print(tidy["status"].value_counts(dropna=False))
@@ -90,22 +93,19 @@ def main():
 
     tidy["year"] = tidy["datetime"].dt.year
 
-    annual = (
-        tidy.groupby(["station", "year"])["value"]
-        .mean()
-        .reset_index()
-        .rename(columns={"value": "annual_mean"})
-    )
+    # One groupby: the grouping (key hashing + group indices) is computed
+    # once and both Cython aggregations reuse it.
+    grouped = tidy.groupby(["station", "year"])["value"]
+    stats = pd.concat(
+        [grouped.mean().rename("annual_mean"), grouped.quantile(0.95).rename("p95")],
+        axis=1,
+    ).reset_index()
 
-    p95 = (
-        tidy.groupby(["station", "year"])["value"]
-        .quantile(0.95)
-        .reset_index()
-        .rename(columns={"value": "p95"})
-    )
+    annual = stats[["station", "year", "annual_mean"]]
+    p95 = stats[["station", "year", "p95"]]
 
-    OUT_ANNUAL.write_text(json.dumps(annual.to_dict(orient="records"), indent=2))
-    OUT_P95.write_text(json.dumps(p95.to_dict(orient="records"), indent=2))
+    OUT_ANNUAL.write_text(json.dumps(annual.to_dict(orient="records"), separators=(",", ":")))
+    OUT_P95.write_text(json.dumps(p95.to_dict(orient="records"), separators=(",", ":")))
 
     print("✅ Processing complete")
     print("Annual rows:", len(annual))
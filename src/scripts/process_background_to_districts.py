@@ -1,10 +1,18 @@
-import json
 from pathlib import Path
 
 import numpy as np
+import orjson
 import pandas as pd
 from pyproj import Transformer
 
+try:  # numba is optional; without it the kernel runs as plain Python
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        def wrap(func):
+            return func
+        return wrap
+
 # ---------- Paths ----------
 BASE = Path(__file__).resolve().parent.parent / "data"
 
@@ -28,14 +36,26 @@ PM25_COL = "Total_PM2.5_25"
 def load_birmingham_postcodes():
     print("📍 Loading Birmingham postcodes from ONS...")
     use_cols = ["pcds", "lad25cd", "east1m", "north1m"]
-    df = pd.read_csv(ONS_FILE, usecols=use_cols)
+    df = pd.read_csv(
+        ONS_FILE,
+        usecols=use_cols,
+        dtype={"east1m": "int32", "north1m": "int32"},
+    )
 
     df = df[df["lad25cd"] == BIRMINGHAM_LAD].copy()
     # District = outward code part, e.g. "B11" from "B11 4AA"
-    df["district"] = df["pcds"].astype(str).str.split().str[0]
+    df["district"] = df["pcds"].astype(str).str.split().str[0].astype("category")
+
+    # Snap to the 1 km grid centre on the raw int arrays: one fused integer
+    # pass, no float temporaries from the pandas // then * + chain.
+    east = df["east1m"].to_numpy()
+    north = df["north1m"].to_numpy()
+    df["grid_x"] = east - east % 1000 + 500
+    df["grid_y"] = north - north % 1000 + 500
 
-    df["grid_x"] = ((df["east1m"] // 1000) * 1000 + 500).astype(int)
-    df["grid_y"] = ((df["north1m"] // 1000) * 1000 + 500).astype(int)
+    # Grid coordinates fit in 32 bits, so pack both into one int64 and let
+    # downstream joins hash a single key instead of a two-column tuple.
+    df["grid_key"] = (df["grid_x"].to_numpy(np.int64) << 32) | df["grid_y"].to_numpy(np.int64)
 
     print(f"  Postcodes in Birmingham: {len(df)}")
 
@@ -67,21 +87,26 @@ def load_background_grid(path: Path, value_col: str) -> pd.DataFrame:
 
     grid = df[cols].copy()
     grid.rename(columns={"x": "grid_x", "y": "grid_y", value_col: "value"}, inplace=True)
+    grid["grid_key"] = (grid["grid_x"].to_numpy(np.int64) << 32) | grid["grid_y"].to_numpy(np.int64)
     return grid
 
 
 def compute_district_means(district_cells: pd.DataFrame, grid: pd.DataFrame, col_name: str):
     """
-    district_cells: columns [district, grid_x, grid_y] (unique per district/grid cell)
-    grid: columns [grid_x, grid_y, value]
+    district_cells: columns [district, grid_key] (unique per district/grid cell)
+    grid: columns [grid_key, value]
     """
-    merged = district_cells.merge(grid, on=["grid_x", "grid_y"], how="left")
+    # Grid cells are unique, so an indexed Series lookup does the job of a
+    # full left merge without materializing a joined frame.
+    lookup = pd.Series(grid["value"].to_numpy(), index=grid["grid_key"].to_numpy())
+    values = lookup.reindex(district_cells["grid_key"].to_numpy()).to_numpy()
 
-    if merged["value"].notna().sum() == 0:
+    if pd.notna(values).sum() == 0:
         raise RuntimeError("❌ ZERO grid matches. Grid snapping is broken.")
 
     grouped = (
-        merged.groupby("district")["value"]
+        pd.DataFrame({"district": district_cells["district"], "value": values})
+        .groupby("district")["value"]
         .mean()
         .reset_index()
         .rename(columns={"value": col_name})
@@ -91,94 +116,86 @@ def compute_district_means(district_cells: pd.DataFrame, grid: pd.DataFrame, col
 
 # ---------- Health band helpers ----------
 
-def band_pollutant(value: float, pollutant: str) -> str:
-    if pd.isna(value):
-        return "Unknown"
-
-    if pollutant == "no2":
-        # µg/m3 annual
-        if value <= 10:
-            return "Excellent"
-        elif value <= 20:
-            return "Good"
-        elif value <= 30:
-            return "Moderate"
-        elif value <= 40:
-            return "Poor"
-        else:
-            return "Very poor"
-
-    if pollutant == "pm25":
-        if value <= 5:
-            return "Excellent"
-        elif value <= 10:
-            return "Good"
-        elif value <= 15:
-            return "Moderate"
-        elif value <= 25:
-            return "Poor"
-        else:
-            return "Very poor"
-
-    if pollutant == "pm10":
-        if value <= 15:
-            return "Excellent"
-        elif value <= 20:
-            return "Good"
-        elif value <= 30:
-            return "Moderate"
-        elif value <= 40:
-            return "Poor"
-        else:
-            return "Very poor"
-
-    return "Unknown"
+# µg/m3 annual-mean band edges (value <= edge falls in that band)
+POLLUTANT_BAND_EDGES = {
+    "no2": np.array([10.0, 20.0, 30.0, 40.0]),
+    "pm25": np.array([5.0, 10.0, 15.0, 25.0]),
+    "pm10": np.array([15.0, 20.0, 30.0, 40.0]),
+}
+POLLUTANT_BAND_LABELS = np.array(["Excellent", "Good", "Moderate", "Poor", "Very poor"])
+
+
+def band_pollutant(values, pollutant: str):
+    values = np.asarray(values, dtype=float)
+    idx = np.searchsorted(
+        POLLUTANT_BAND_EDGES[pollutant],
+        np.nan_to_num(values, nan=np.inf),
+        side="left",
+    )
+    return np.where(np.isnan(values), "Unknown", POLLUTANT_BAND_LABELS[idx])
 
 
-def pollutant_risk(value: float, pollutant: str) -> float:
+@njit(cache=True)
+def score_kernel(no2, pm10, pm25, w_no2, w_pm10, w_pm25):
     """
-    Map concentration → [0,1] risk, using WHO guideline as zero
-    and UK/EU legal limit as 1.
+    Fused risk → weighted mean → score pass over the three pollutant
+    arrays. Per-pollutant risk runs from the WHO guideline (0) to the
+    UK/EU legal limit (1): NO2 10–40, PM10 15–40, PM2.5 5–25 µg/m3.
+    Pollutants with missing data drop out of the weighted mean.
     """
-    if pd.isna(value):
-        return np.nan
-
-    if pollutant == "no2":
-        safe = 10.0
-        upper = 40.0
-    elif pollutant == "pm25":
-        safe = 5.0
-        upper = 25.0
-    elif pollutant == "pm10":
-        safe = 15.0
-        upper = 40.0
-    else:
-        return np.nan
-
-    if value <= safe:
-        return 0.0
-    if value >= upper:
-        return 1.0
-    return (value - safe) / (upper - safe)
-
-
-def band_overall(score: float) -> str:
-    if pd.isna(score):
-        return "Unknown"
-
-    if score >= 85:
-        return "Excellent environmental health"
-    if score >= 75:
-        return "Very good environmental health"
-    if score >= 65:
-        return "Good environmental health"
-    if score >= 50:
-        return "Moderate environmental health"
-    if score >= 35:
-        return "Poor environmental health"
-    if score >= 20:
-        return "Very poor environmental health"
-    return "Hazardous environmental health"
+    n = no2.shape[0]
+    risk = np.empty(n)
+    score = np.empty(n)
+
+    for i in range(n):
+        num = 0.0
+        den = 0.0
+
+        v = no2[i]
+        if not np.isnan(v):
+            num += w_no2 * min(max((v - 10.0) / 30.0, 0.0), 1.0)
+            den += w_no2
+
+        v = pm10[i]
+        if not np.isnan(v):
+            num += w_pm10 * min(max((v - 15.0) / 25.0, 0.0), 1.0)
+            den += w_pm10
+
+        v = pm25[i]
+        if not np.isnan(v):
+            num += w_pm25 * min(max((v - 5.0) / 20.0, 0.0), 1.0)
+            den += w_pm25
+
+        if den > 0.0:
+            risk[i] = num / den
+            score[i] = min(max(100.0 * (1.0 - risk[i]), 0.0), 100.0)
+        else:
+            risk[i] = np.nan
+            score[i] = np.nan
+
+    return risk, score
+
+
+OVERALL_BAND_EDGES = np.array([20.0, 35.0, 50.0, 65.0, 75.0, 85.0])
+OVERALL_BAND_LABELS = np.array([
+    "Hazardous environmental health",
+    "Very poor environmental health",
+    "Poor environmental health",
+    "Moderate environmental health",
+    "Good environmental health",
+    "Very good environmental health",
+    "Excellent environmental health",
+])
+
+
+def band_overall(scores):
+    scores = np.asarray(scores, dtype=float)
+    idx = np.searchsorted(
+        OVERALL_BAND_EDGES,
+        np.nan_to_num(scores, nan=-np.inf),
+        side="right",
+    )
+    return np.where(np.isnan(scores), "Unknown", OVERALL_BAND_LABELS[idx])
 
 
 # ---------- Main ----------
@@ -197,7 +214,7 @@ def main():
 
     # Unique grid cells per district (for pollution averaging)
     district_cells = (
-        ons[["district", "grid_x", "grid_y"]]
+        ons[["district", "grid_key"]]
         .drop_duplicates()
         .reset_index(drop=True)
     )
@@ -225,41 +242,25 @@ def main():
     df = df.merge(pm25_means, on="district", how="left")
 
     # 5. Per-pollutant bands
-    df["no2_band"] = df["no2"].apply(lambda v: band_pollutant(v, "no2"))
-    df["pm10_band"] = df["pm10"].apply(lambda v: band_pollutant(v, "pm10"))
-    df["pm25_band"] = df["pm25"].apply(lambda v: band_pollutant(v, "pm25"))
+    df["no2_band"] = band_pollutant(df["no2"].to_numpy(), "no2")
+    df["pm10_band"] = band_pollutant(df["pm10"].to_numpy(), "pm10")
+    df["pm25_band"] = band_pollutant(df["pm25"].to_numpy(), "pm25")
 
     # 6. Composite air_quality_score
     weights = {"no2": 0.3, "pm10": 0.2, "pm25": 0.5}
 
-    risks = pd.DataFrame(
-        {
-            "no2_risk": df["no2"].apply(lambda v: pollutant_risk(v, "no2")),
-            "pm10_risk": df["pm10"].apply(lambda v: pollutant_risk(v, "pm10")),
-            "pm25_risk": df["pm25"].apply(lambda v: pollutant_risk(v, "pm25")),
-        }
+    risk, score = score_kernel(
+        df["no2"].to_numpy(dtype=float),
+        df["pm10"].to_numpy(dtype=float),
+        df["pm25"].to_numpy(dtype=float),
+        weights["no2"],
+        weights["pm10"],
+        weights["pm25"],
     )
 
-    # Weighted risk per row
-    def row_weighted_risk(row):
-        num = 0.0
-        den = 0.0
-        for pol, col in [("no2", "no2_risk"), ("pm10", "pm10_risk"), ("pm25", "pm25_risk")]:
-            r = row[col]
-            if pd.isna(r):
-                continue
-            w = weights[pol]
-            num += w * r
-            den += w
-        if den == 0:
-            return np.nan
-        return num / den
-
-    df["weighted_risk"] = risks.apply(row_weighted_risk, axis=1)
-
-    df["air_quality_score"] = (100 * (1 - df["weighted_risk"])).clip(lower=0, upper=100)
-    df["air_quality_score"] = df["air_quality_score"].round(1)
-    df["air_quality_band"] = df["air_quality_score"].apply(band_overall)
+    df["weighted_risk"] = risk
+    df["air_quality_score"] = np.round(score, 1)
+    df["air_quality_band"] = band_overall(df["air_quality_score"].to_numpy())
 
     # 7. Sort districts nicely
     # Try numeric sort on the number part of "B10", "B11", etc.
@@ -271,11 +272,14 @@ def main():
             num = 999
         return (s[0], num)
 
-    df = df.sort_values("district", key=lambda s: s.map(district_sort_key))
+    # Map the key over plain strings: tuple keys from a Categorical build a
+    # MultiIndex of categories, which pandas cannot sort on
+    df = df.sort_values("district", key=lambda s: s.astype(str).map(district_sort_key))
 
-    # 8. Export
+    # 8. Export — orjson writes NaN as null, keeping the file valid strict
+    # JSON for districts with no grid coverage (stdlib json emits bare NaN)
     records = df.to_dict(orient="records")
-    OUT_FILE.write_text(json.dumps(records, indent=2))
+    OUT_FILE.write_bytes(orjson.dumps(records))
     print(f"✅ Saved → {OUT_FILE}")
     print(f"  Districts: {len(df)}")
 
@@ -2,20 +2,37 @@
 import os
 os.environ["SHAPE_RESTORE_SHX"] = "YES"
 
-import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import orjson
+
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import pyarrow.dataset as ds
+import shapely
+from scipy.spatial import cKDTree
+from scipy.stats import rankdata
 from shapely.geometry import Point
 
+try:  # numba is optional; without it the kernel runs as plain Python
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        def wrap(func):
+            return func
+        return wrap
+
 # ---------- Paths & constants ----------
 
 BASE = Path(__file__).resolve().parent.parent / "data"
 GREEN_DIR = BASE / "_green"
 
 ONS_FILE = BASE / "ons_postcode_dir.csv"
+ONS_CACHE = BASE / "_cache" / "ons_birmingham.parquet"
+SITES_CACHE = BASE / "_cache" / "greenspace_sites.parquet"
+ACCESS_CACHE = BASE / "_cache" / "greenspace_access.parquet"
 OUT_FILE = BASE / "birmingham_greenspace_by_district.json"
 
 BIRMINGHAM_LAD = "E08000025"
@@ -32,16 +49,34 @@ def load_birmingham_postcodes() -> gpd.GeoDataFrame:
     derive outward district (B1, B2, ...) and create BNG point geometry.
     """
     print("📍 Loading Birmingham postcodes from ONS...")
-    use_cols = ["pcds", "lad25cd", "east1m", "north1m"]
-    df = pd.read_csv(ONS_FILE, usecols=use_cols)
-
-    df = df[df["lad25cd"] == BIRMINGHAM_LAD].copy()
-    df["district"] = df["pcds"].astype(str).str.split().str[0]
-
-    # Geometry in British National Grid (metres)
+    if ONS_CACHE.exists() and ONS_CACHE.stat().st_mtime >= ONS_FILE.stat().st_mtime:
+        # The CSV rarely changes; the filtered subset loads in milliseconds
+        # from the Parquet sidecar.
+        df = pd.read_parquet(ONS_CACHE)
+    else:
+        # Arrow's CSV scanner projects the four columns and evaluates the
+        # LAD filter in C++, so only Birmingham rows materialize in pandas.
+        dataset = ds.dataset(str(ONS_FILE), format="csv")
+        table = dataset.to_table(
+            columns=["pcds", "lad25cd", "east1m", "north1m"],
+            filter=ds.field("lad25cd") == BIRMINGHAM_LAD,
+        )
+        df = table.to_pandas()
+        # partition stops at the first space instead of splitting the
+        # whole string and indexing back into the pieces. The handful of
+        # outward codes make a small category vocabulary, so groupbys
+        # downstream hash integer codes instead of strings (the dtype
+        # round-trips through the Parquet cache).
+        df["district"] = df["pcds"].astype(str).str.partition(" ")[0].astype("category")
+
+        ONS_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(ONS_CACHE, engine="pyarrow", compression="zstd")
+
+    # Geometry in British National Grid (metres); shapely.points builds the
+    # geometry array in one C call straight from the coordinate columns.
     gdf = gpd.GeoDataFrame(
         df,
-        geometry=gpd.points_from_xy(df["east1m"], df["north1m"]),
+        geometry=shapely.points(df["east1m"].to_numpy(), df["north1m"].to_numpy()),
         crs=BNG_CRS,
     )
 
@@ -49,63 +84,69 @@ def load_birmingham_postcodes() -> gpd.GeoDataFrame:
     return gdf
 
 
-def load_greenspace_tiles(postcodes: gpd.GeoDataFrame):
+def _load_merged_tiles(suffix: str, cache: Path, bbox: tuple) -> gpd.GeoDataFrame:
     """
-    Load OS Open Greenspace site polygons and access point geometries
-    for the WMCA area, then spatially trim to a padded bbox around
-    Birmingham postcodes.
+    Merge the four OS Open Greenspace tiles for one layer (site polygons
+    or access points) into a single GeoDataFrame, serving the result from
+    a GeoParquet cache after the first run — one columnar read instead of
+    four shapefile parses. bbox (BNG metres) is pushed down to GDAL so
+    features outside the padded Birmingham extent are skipped on disk.
     """
-    print("🌳 Loading OS Open Greenspace tiles...")
-
-    parks_list = []
-    access_list = []
-
+    if cache.exists():
+        return gpd.read_parquet(cache)
+
+    def _read(path):
+        g = gpd.read_file(path, bbox=bbox)
+        if g.crs is None:
+            return g.set_crs(BNG_CRS)
+        if g.crs.to_epsg() == 27700:
+            # OS tiles already ship in BNG; to_crs would rebuild every
+            # geometry just to apply the identity transform
+            return g
+        return g.to_crs(BNG_CRS)
+
+    paths = []
     for tile in GREEN_TILES:
-        site_path = GREEN_DIR / f"{tile}_GreenspaceSite.shp"
-        acc_path = GREEN_DIR / f"{tile}_AccessPoint.shp"
-
-        if site_path.exists():
-            g = gpd.read_file(site_path)
-            if g.crs is None:
-                g = g.set_crs(BNG_CRS)
-            else:
-                g = g.to_crs(BNG_CRS)
-            parks_list.append(g)
+        path = GREEN_DIR / f"{tile}_{suffix}.shp"
+        if path.exists():
+            paths.append(path)
         else:
-            print(f"  ⚠️ Missing greenspace site shapefile: {site_path}")
-
-        if acc_path.exists():
-            g = gpd.read_file(acc_path)
-            if g.crs is None:
-                g = g.set_crs(BNG_CRS)
-            else:
-                g = g.to_crs(BNG_CRS)
-            access_list.append(g)
-        else:
-            print(f"  ⚠️ Missing access point shapefile: {acc_path}")
+            print(f"  ⚠️ Missing shapefile: {path}")
 
-    if not parks_list or not access_list:
+    if not paths:
         raise RuntimeError("No greenspace shapefiles loaded. Check _green directory.")
 
-    parks = gpd.GeoDataFrame(
-        pd.concat(parks_list, ignore_index=True),
-        crs=BNG_CRS,
-    )
-    access_points = gpd.GeoDataFrame(
-        pd.concat(access_list, ignore_index=True),
-        crs=BNG_CRS,
-    )
+    # Each tile is an independent GDAL read that releases the GIL, so the
+    # four parses overlap instead of running back to back.
+    with ThreadPoolExecutor(max_workers=len(paths)) as ex:
+        frames = list(ex.map(_read, paths))
+
+    merged = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=BNG_CRS)
 
     # Drop empties
-    parks = parks[parks.geometry.notna() & ~parks.geometry.is_empty].copy()
-    access_points = access_points[access_points.geometry.notna() & ~access_points.geometry.is_empty].copy()
+    merged = merged[merged.geometry.notna() & ~merged.geometry.is_empty].copy()
 
-    # Trim to bbox around Birmingham postcodes (+5 km padding)
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    merged.to_parquet(cache)
+    return merged
+
+
+def load_greenspace_tiles(postcodes: gpd.GeoDataFrame):
+    """
+    Load OS Open Greenspace site polygons and access point geometries
+    for the WMCA area, then spatially trim to a padded bbox around
+    Birmingham postcodes.
+    """
+    # bbox around Birmingham postcodes (+5 km padding)
     minx, miny, maxx, maxy = postcodes.total_bounds
     pad = 5000.0
+    bbox = (minx - pad, miny - pad, maxx + pad, maxy + pad)
 
-    parks = parks.cx[minx - pad:maxx + pad, miny - pad:maxy + pad]
-    access_points = access_points.cx[minx - pad:maxx + pad, miny - pad:maxy + pad]
+    print("🌳 Loading OS Open Greenspace tiles...")
+    # The read-time bbox already restricts both layers to the padded
+    # extent, so no second spatial trim is needed.
+    parks = _load_merged_tiles("GreenspaceSite", SITES_CACHE, bbox)
+    access_points = _load_merged_tiles("AccessPoint", ACCESS_CACHE, bbox)
 
     print(f"  Parks loaded: {len(parks)}")
     print(f"  Access points loaded: {len(access_points)}")
@@ -122,23 +163,29 @@ def compute_distances_by_district(
     """
     print("📏 Computing nearest access distances...")
 
-    # sjoin_nearest will add distance in CRS units (metres in EPSG:27700)
-    nearest = gpd.sjoin_nearest(
-        postcodes[["district", "geometry"]],
-        access_points[["geometry"]],
-        how="left",
-        distance_col="greenspace_dist_m",
-    )
+    # Both sides are plain points, so a KD-tree over the raw coordinate
+    # arrays answers nearest-neighbour in one query — no geometry objects
+    # involved, and the distances come back for free (metres in EPSG:27700).
+    post_xy = shapely.get_coordinates(postcodes.geometry.values)
+    access_xy = shapely.get_coordinates(access_points.geometry.values)
+    # workers=-1 splits the query batch across all cores
+    dist, _ = cKDTree(access_xy).query(post_xy, k=1, workers=-1)
 
-    dist_stats = (
-        nearest.groupby("district")["greenspace_dist_m"]
-        .agg(
-            greenspace_mean_dist_m="mean",
-            greenspace_p75_dist_m=lambda s: s.quantile(0.75),
-        )
-        .reset_index()
+    nearest = pd.DataFrame(
+        {"district": postcodes["district"].to_numpy(), "greenspace_dist_m": dist}
     )
 
+    # Both aggregations dispatch to the Cython groupby kernels; the lambda
+    # form forced a Python call per group for the quantile.
+    grouped = nearest.groupby("district")["greenspace_dist_m"]
+    dist_stats = pd.concat(
+        [
+            grouped.mean().rename("greenspace_mean_dist_m"),
+            grouped.quantile(0.75).rename("greenspace_p75_dist_m"),
+        ],
+        axis=1,
+    ).reset_index()
+
     return dist_stats
 
 
@@ -152,19 +199,24 @@ def compute_area_by_district(
     print("🗺️ Estimating greenspace area by district...")
 
     parks = parks.copy()
-    parks["area_m2"] = parks.geometry.area
-
-    joined = gpd.sjoin_nearest(
-        parks[["area_m2", "geometry"]],
-        postcodes[["district", "geometry"]],
-        how="left",
-    )
+    # Vectorized GEOS call on the raw geometry array (Shapely 2), without
+    # the GeoSeries property dispatch
+    parks["area_m2"] = shapely.area(parks.geometry.values)
+
+    # Assign each park to the postcode nearest its centroid. Reducing the
+    # polygons to centroid coordinates turns the polygon-vs-point nearest
+    # search into a pure point KD-tree query, which is far cheaper than
+    # GEOS distance tests against full boundaries.
+    centroids = shapely.centroid(parks.geometry.values)
+    park_xy = np.column_stack([shapely.get_x(centroids), shapely.get_y(centroids)])
+    post_xy = shapely.get_coordinates(postcodes.geometry.values)
+    _, idx = cKDTree(post_xy).query(park_xy, k=1, workers=-1)
+    districts = postcodes["district"].to_numpy()[idx]
 
     area_stats = (
-        joined.dropna(subset=["district"])
-        .groupby("district")["area_m2"]
+        pd.DataFrame({"district": districts, "area_m2": parks["area_m2"].to_numpy()})
+        .groupby("district", as_index=False)["area_m2"]
         .sum()
-        .reset_index()
         .rename(columns={"area_m2": "total_greenspace_m2"})
     )
 
@@ -173,6 +225,43 @@ def compute_area_by_district(
 
 # ---------- Greenspace risk model ----------
 
+@njit(cache=True)
+def greenspace_risk_kernel(blended, capacity_risk, alpha, beta):
+    """
+    Fused access-risk → blend → score pass. Access risk is linear from
+    100 m (0) to 1000 m (1); it blends with capacity risk at alpha/beta,
+    falling back to whichever component is present when the other is NaN.
+    """
+    n = blended.shape[0]
+    access = np.empty(n)
+    risk = np.empty(n)
+    score = np.empty(n)
+
+    for i in range(n):
+        d = blended[i]
+        if np.isnan(d):
+            ra = np.nan
+        else:
+            ra = min(max((d - 100.0) / 900.0, 0.0), 1.0)
+        access[i] = ra
+
+        rc = capacity_risk[i]
+        if np.isnan(ra):
+            r = rc
+        elif np.isnan(rc):
+            r = ra
+        else:
+            r = alpha * ra + beta * rc
+        risk[i] = r
+
+        if np.isnan(r):
+            score[i] = np.nan
+        else:
+            score[i] = min(max(100.0 * (1.0 - r), 0.0), 100.0)
+
+    return access, risk, score
+
+
 def add_greenspace_risk_and_score(df: pd.DataFrame) -> pd.DataFrame:
     """
     Attach greenspace_risk, greenspace_score and greenspace_band to df.
@@ -183,60 +272,38 @@ def add_greenspace_risk_and_score(df: pd.DataFrame) -> pd.DataFrame:
         0.4 * df["greenspace_mean_dist_m"] + 0.6 * df["greenspace_p75_dist_m"]
     )
 
-    def access_risk(d):
-        if pd.isna(d):
-            return np.nan
-        # 0 risk <=100 m, 1 risk >=1000 m, linear in between
-        if d <= 100.0:
-            return 0.0
-        if d >= 1000.0:
-            return 1.0
-        return (d - 100.0) / 900.0
-
-    df["greenspace_access_risk"] = df["greenspace_blended_dist_m"].apply(access_risk)
-
-    # Capacity risk via percentile rank of greenspace_per_postcode_m2
-    cap = df["greenspace_per_postcode_m2"]
-    cap_pct = cap.rank(pct=True)
-    cap_pct = cap_pct.where(~cap.isna(), np.nan)
+    # Capacity risk via percentile rank of greenspace_per_postcode_m2;
+    # rankdata on the raw array with average ties matches Series.rank(pct=True)
+    # once divided by the non-NaN count
+    cap = df["greenspace_per_postcode_m2"].to_numpy(dtype=np.float64)
+    mask = ~np.isnan(cap)
+    cap_pct = np.full(cap.shape, np.nan)
+    cap_pct[mask] = rankdata(cap[mask], method="average") / mask.sum()
 
     df["greenspace_capacity_risk"] = 1.0 - cap_pct
 
-    # Combine; access gets more weight
-    alpha = 0.6
-    beta = 0.4
-
-    def combine(row):
-        ra = row["greenspace_access_risk"]
-        rc = row["greenspace_capacity_risk"]
-
-        if pd.isna(ra) and pd.isna(rc):
-            return np.nan
-        if pd.isna(ra):
-            return rc
-        if pd.isna(rc):
-            return ra
-        return alpha * ra + beta * rc
-
-    df["greenspace_risk"] = df.apply(combine, axis=1)
-
-    df["greenspace_score"] = (100.0 * (1.0 - df["greenspace_risk"])).clip(0, 100)
-    df["greenspace_score"] = df["greenspace_score"].round(1)
-
-    def band(score):
-        if pd.isna(score):
-            return "Unknown"
-        if score >= 85:
-            return "Excellent access to greenspace"
-        if score >= 70:
-            return "Good access to greenspace"
-        if score >= 55:
-            return "Moderate access to greenspace"
-        if score >= 40:
-            return "Poor access to greenspace"
-        return "Very poor access to greenspace"
-
-    df["greenspace_band"] = df["greenspace_score"].apply(band)
+    # Access gets more weight in the blend
+    access, risk, score = greenspace_risk_kernel(
+        df["greenspace_blended_dist_m"].to_numpy(dtype=np.float64),
+        df["greenspace_capacity_risk"].to_numpy(dtype=np.float64),
+        0.6,
+        0.4,
+    )
+    df["greenspace_access_risk"] = access
+    df["greenspace_risk"] = risk
+    df["greenspace_score"] = np.round(score, 1)
+
+    # Left-inclusive bins mirror the old >= ladder; NaN scores stay Unknown
+    bins = [-np.inf, 40, 55, 70, 85, np.inf]
+    labels = [
+        "Very poor access to greenspace",
+        "Poor access to greenspace",
+        "Moderate access to greenspace",
+        "Good access to greenspace",
+        "Excellent access to greenspace",
+    ]
+    band = pd.cut(df["greenspace_score"], bins=bins, labels=labels, right=False).astype(object)
+    df["greenspace_band"] = band.where(df["greenspace_score"].notna(), "Unknown")
     return df
 
 
@@ -271,9 +338,16 @@ def main():
 
     print("🧮 Aggregating district greenspace stats...")
 
-    # 4. Merge all pieces
-    df = postcode_counts.merge(area_stats, on="district", how="left")
-    df = df.merge(dist_stats, on="district", how="left")
+    # 4. Align all pieces on the district index in one pass; the chained
+    # merges re-hashed the key column for every join.
+    df = pd.concat(
+        [
+            postcode_counts.set_index("district"),
+            area_stats.set_index("district"),
+            dist_stats.set_index("district"),
+        ],
+        axis=1,
+    ).reset_index()
 
     # Per-postcode greenspace capacity
     df["greenspace_per_postcode_m2"] = (
@@ -286,9 +360,10 @@ def main():
     # 6. Sort districts nicely
     df = df.sort_values("district", key=lambda s: s.map(district_sort_key))
 
-    # 7. Export
+    # 7. Export — orjson serializes in native code and writes NaN as null,
+    # so the file is valid strict JSON (stdlib json emitted bare NaN tokens)
     records = df.to_dict(orient="records")
-    OUT_FILE.write_text(json.dumps(records, indent=2))
+    OUT_FILE.write_bytes(orjson.dumps(records))
 
     print(f"✅ Saved → {OUT_FILE}")
     print(f"  Districts: {len(df)}")